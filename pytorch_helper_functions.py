@@ -6,10 +6,13 @@ Description: This file contains helper functions for the pytorch introduction
 """
 
 import numpy as np
+import random
 import torch
 import os
 from torch.utils.tensorboard import SummaryWriter
 from datetime import datetime
+from contextlib import contextmanager
+from time import perf_counter
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -17,16 +20,21 @@ from datetime import datetime
 # Checked: Function works
 
 
-def create_writer(experiment_name: str, model_name: str, extra: str = None):
+def create_writer(experiment_name: str, model_name: str, extra: str = None, flush_secs: int = 120,
+                  max_queue: int = 1000):
     """
     This function creates a torch.utils.tensorboard.writer.SummaryWriter()
     instance saving to a specific log_dir, which
     is a combination of runs/timestamp/experiment_name/model_name/extra.
     Where timestamp is the current date in YYYY-MM-DD format.
+    Events are buffered (up to max_queue events or flush_secs seconds) to keep disk writes rare,
+    call writer.flush() to write them out earlier.
 
     :param experiment_name: str: Name of experiment.
     :param model_name: str: Name of model.
     :param extra: str: Anything extra to add to the directory. Defaults to None.
+    :param flush_secs: int: How often, in seconds, to flush the pending events to disk. Defaults to 120.
+    :param max_queue: int: Number of pending events to buffer before flushing to disk. Defaults to 1000.
     :return: torch.utils.tensorboard.writer.SummaryWriter(): Instance of a writer saving to log_dir.
     """
 
@@ -42,7 +50,7 @@ def create_writer(experiment_name: str, model_name: str, extra: str = None):
     # print
     print(f"Created SummaryWriter, saving to: {log_dir}.")
 
-    return SummaryWriter(log_dir=log_dir)
+    return SummaryWriter(log_dir=log_dir, flush_secs=flush_secs, max_queue=max_queue)
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -68,18 +76,49 @@ def walk_through_directory(dir_path: str):
 
 # Checked: Function works
 
-def set_global_seed(seed: int = 42):
+def set_global_seed(seed: int = 42, deterministic: bool = False):
     """
     This function sets the global seed for all random number generators.
 
     :param seed: int: seed to set
+    :param deterministic: bool: use deterministic cuDNN algorithms (disables the speedup of configure_backends). Defaults to False.
     :return: None
     """
 
-    # set the seed for numpy, torch and cuda
+    # set the seed for python, numpy and torch
+    random.seed(seed)
     np.random.seed(seed)
     torch.manual_seed(seed)
-    torch.cuda.manual_seed(seed)
+
+    # only touch cuda if a gpu is present (initializing the runtime is slow), seed all gpus for distributed training
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
+
+    # opt-in: reproducible but slower convolutions
+    if deterministic:
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+
+    return None
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def configure_backends():
+    """
+    This function enables the cuDNN autotuner and TF32 for matmuls and convolutions.
+    The autotuner assumes stable input shapes (true for a dataloader with a constant batch size).
+
+    :return: None
+    """
+
+    # let cuDNN benchmark and pick the fastest convolution algorithms
+    torch.backends.cudnn.benchmark = True
+
+    # allow TF32 tensor cores for matmuls and convolutions on ampere and newer gpus
+    torch.set_float32_matmul_precision("high")
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
 
     return None
 
@@ -88,13 +127,16 @@ def set_global_seed(seed: int = 42):
 
 # Checked: Function works
 
-def print_train_time(start: float, end: float, device: str = None):
+def print_train_time(start: float, end: float, device: str = None, verbose: bool = True):
     """
     This function prints the time it took to train the model.
+    Take start and end with time.perf_counter() (higher resolution than time.time()), on cuda call
+    torch.cuda.synchronize() before taking end or use timer.
 
-    :param start: float: Start time of computation (preferred in timeit format).
+    :param start: float: Start time of computation (preferred from time.perf_counter()).
     :param end: float: End time of computation.
     :param device: str: Device that compute is running on. Defaults to None.
+    :param verbose: bool: print the total time. Defaults to True.
     :return: total_time: float: time between start and end in seconds (higher is longer).
     """
 
@@ -102,11 +144,41 @@ def print_train_time(start: float, end: float, device: str = None):
     total_time = end - start
 
     # print the total time
-    print(f"\nTrain time on {device}: {total_time:.3f} seconds")
+    if verbose:
+        print(f"\nTrain time on {device}: {total_time:.3f} seconds")
 
     return total_time
 
 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+@contextmanager
+def timer(device: str = None, verbose: bool = True):
+    """
+    This function times the code inside a with block using time.perf_counter().
+    On cuda it waits for the queued kernels to finish before taking the end time, as they run asynchronously.
+
+    :param device: str: Device that compute is running on. Defaults to None.
+    :param verbose: bool: print the total time. Defaults to True.
+    :return: times: dict: Filled with the time in seconds under "total_time" when the block exits.
+    """
+
+    # synchronize cuda only if the code runs on a gpu
+    use_cuda = device is not None and torch.device(device).type == "cuda"
+
+    times = {}
+    if use_cuda:
+        torch.cuda.synchronize(device)
+    start = perf_counter()
+
+    try:
+        yield times
+    finally:
+        if use_cuda:
+            torch.cuda.synchronize(device)
+        times["total_time"] = print_train_time(start=start, end=perf_counter(), device=device, verbose=verbose)
+
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 # Checked: Function works
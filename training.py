@@ -5,10 +5,93 @@ Date: 28.05.23
 Description: This file contains the batch training script
 """
 
+import contextlib
+import os
+import numpy as np
 import pandas as pd
 import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data import DataLoader, Dataset
+from torch.utils.data.distributed import DistributedSampler
 from tqdm.auto import tqdm
 import torchmetrics
+from pytorch_helper_functions import create_writer
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+class CUDAPrefetcher:
+    """
+
+    This class wraps a dataloader and copies the next batch to the cuda device on a side stream while the current
+    batch is computing. Build the dataloader with pin_memory=True so the copies are asynchronous.
+
+    :param dataloader: torch.utils.data.DataLoader: Dataloader to prefetch from.
+    :param device: torch.device: Cuda device to copy the batches to.
+    """
+
+    def __init__(self, dataloader: torch.utils.data.DataLoader, device: torch.device):
+
+        self.dataloader = dataloader
+        self.device = device
+
+        # side stream for the host to device copies
+        self.stream = torch.cuda.Stream(device=device)
+
+        self.loader_iter = None
+        self.next_X, self.next_y = None, None
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def __iter__(self):
+
+        # start a new pass over the dataloader and copy the first batch
+        self.loader_iter = iter(self.dataloader)
+        self.preload()
+
+        return self
+
+    def preload(self):
+        """
+
+        This function copies the next batch to the device on the side stream.
+
+        :return: None
+        """
+
+        try:
+            X, y = next(self.loader_iter)
+        except StopIteration:
+            self.next_X, self.next_y = None, None
+            return None
+
+        # put data on device
+        with torch.cuda.stream(self.stream):
+            self.next_X = X.to(self.device, non_blocking=True)
+            self.next_y = y.to(self.device, non_blocking=True)
+
+        return None
+
+    def __next__(self):
+
+        if self.next_X is None:
+            raise StopIteration
+
+        # wait for the copy of the current batch to finish before using it
+        current_stream = torch.cuda.current_stream(self.device)
+        current_stream.wait_stream(self.stream)
+        X, y = self.next_X, self.next_y
+
+        # tell the caching allocator the tensors are used on the compute stream
+        X.record_stream(current_stream)
+        y.record_stream(current_stream)
+
+        # start copying the next batch
+        self.preload()
+
+        return X, y
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -18,10 +101,15 @@ import torchmetrics
 def training(EPOCHS: int, model: torch.nn.Module, train_dataloader: torch.utils.data.DataLoader,
              val_dataloader: torch.utils.data.DataLoader, loss_function: torch.nn.Module,
              optimizer: torch.optim.Optimizer, epoch_print: int, writer: torch.utils.tensorboard.writer.SummaryWriter,
-             device: torch.device = "cpu"):
+             device: torch.device = "cpu", accumulation_steps: int = 1, num_classes: int = None,
+             return_predictions: bool = False, compile_model: bool = True):
     """
 
     This function trains the model and prints the training and validation loss per epoch.
+    Batches are copied to the device asynchronously. To overlap the copies with compute, build the dataloaders with
+    DataLoader(..., pin_memory=True, num_workers=2 (or more), persistent_workers=True).
+    On cuda the model is compiled with torch.compile (if available and compile_model): the first batches are slow while
+    compiling and the batches should have a consistent shape (e.g. drop_last=True) to avoid recompilations.
 
     :param EPOCHS: int: Number of epochs to train the model.
     :param model: object: Model to train.
@@ -30,13 +118,48 @@ def training(EPOCHS: int, model: torch.nn.Module, train_dataloader: torch.utils.
     :param loss_function: object: Loss function to use.
     :param optimizer: object: Optimizer to use.
     :param epoch_print: int: print each epoch_print epochs.
-    :param writer: torch.utils.tensorboard.writer.SummaryWriter: Tensorboard writer.
+    :param writer: torch.utils.tensorboard.writer.SummaryWriter: Tensorboard writer, ideally with a high flush_secs and
+        max_queue (see create_writer) as it is only flushed every epoch_print epochs. None disables logging.
     :param device: string: Device to use. Defaults to "cpu".
-    :return: df_scores: pandas.DataFrame: Dataframe with the training and validation loss per epoch and predictions of the last epoch.
+    :param accumulation_steps: int: Number of batches to accumulate gradients over before each optimizer step (at least 1). Defaults to 1.
+    :param num_classes: int: Number of classes. Defaults to None (inferred once from the model output of the first training batch).
+    :param return_predictions: bool: Also return the logits and true labels of the last epoch (needs num_classes, the
+        logits of a whole dataset are kept on the device). Defaults to False.
+    :param compile_model: bool: Compile the model with torch.compile when training on cuda. Defaults to True.
+    :return: df_scores: pandas.DataFrame: Dataframe with the training and validation loss per epoch. With
+        return_predictions also train_predictions, val_predictions: dict: the logits ("logits", shape (N, num_classes))
+        and true labels ("true") of the last epoch as numpy arrays.
     """
 
+    if accumulation_steps < 1:
+        raise ValueError(f"accumulation_steps must be at least 1, got {accumulation_steps}.")
+    if return_predictions and num_classes is None:
+        raise ValueError("num_classes is required to return the predictions.")
+    if num_classes is None and len(train_dataloader) == 0:
+        raise ValueError("num_classes can not be inferred from an empty train_dataloader, pass num_classes.")
+
+    # in distributed training only the first process prints
+    is_main_process = not dist.is_initialized() or dist.get_rank() == 0
+
     # print
-    print(f"Starting training.")
+    if is_main_process:
+        print(f"Starting training.")
+
+    # mixed precision: run the forward pass and loss in bfloat16 on cuda (no GradScaler needed for bfloat16)
+    use_cuda = torch.device(device).type == "cuda"
+
+    # pre-ampere gpus have no bfloat16 support: fall back to float16 with a GradScaler to avoid gradient underflow
+    # (is_bf16_supported() also counts emulated bfloat16, so check the compute capability of the device instead)
+    use_fp16 = use_cuda and torch.cuda.get_device_capability(device)[0] < 8
+    amp_dtype = torch.float16 if use_fp16 else torch.bfloat16
+    scaler = torch.amp.GradScaler("cuda", enabled=use_fp16)
+
+    # accuracy metrics keep their state on the device and are only built once
+    # (on the first training batch if num_classes has to be inferred from the model output)
+    train_acc_metric, val_acc_metric = None, None
+    if num_classes is not None:
+        train_acc_metric = torchmetrics.Accuracy(task="multiclass", num_classes=num_classes).to(device)
+        val_acc_metric = torchmetrics.Accuracy(task="multiclass", num_classes=num_classes).to(device)
 
     # dict with empty lists to store the loss values
     results = {"Epoch": [],
@@ -46,109 +169,302 @@ def training(EPOCHS: int, model: torch.nn.Module, train_dataloader: torch.utils.
                "Validation Accuracy": []
                }
 
-    # create a training and test loop
-    for epoch in tqdm(range(EPOCHS)):
+    # unwrapped model (a DistributedDataParallel forward would wait for the other processes)
+    ddp_model = model if isinstance(model, DDP) else None
+    base_model = model.module if ddp_model is not None else model
 
-        # train loss counter
-        batch_train_loss, batch_train_acc = 0, 0
+    # channels_last (NHWC) layout for the conv weights gives faster tensor core kernels (only 4D weights are affected)
+    # a DistributedDataParallel model is already converted by ddp_training, changing it here would break its buckets
+    if ddp_model is None:
+        model = model.to(memory_format=torch.channels_last)
 
-        # model to train mode
-        model.train()
+    # Track the PyTorch model architecture once, and pass in an example input created directly on the device
+    if writer is not None:
+        example = torch.randn(32, 3, 224, 224, device=device)
+        writer.add_graph(model=base_model, input_to_model=example)
 
-        # training: loop thorugh the training batches
-        for batch, (X_train, y_train) in enumerate(train_dataloader):
+    # compile the model for kernel fusion on cuda (after add_graph, which traces the eager model)
+    # (on cpu there are no cuda graphs to gain and inductor would need a c++ toolchain)
+    if compile_model and use_cuda and hasattr(torch, "compile"):
+        model = torch.compile(model, mode="reduce-overhead", dynamic=False)
+
+    # on cuda the next batch is copied to the device on a side stream while the current batch is computing
+    # (built once, every epoch iterates over them again)
+    train_batches = CUDAPrefetcher(train_dataloader, device) if use_cuda else train_dataloader
+    val_batches = CUDAPrefetcher(val_dataloader, device) if use_cuda else val_dataloader
+
+    # number of batches and samples (of this process), computed once (len of a dataloader goes through its sampler)
+    n_train_batches, n_val_batches = len(train_dataloader), len(val_dataloader)
+    n_train_samples, n_val_samples = len(train_dataloader.sampler), len(val_dataloader.sampler)
+
+    # per batch losses, filled by index and averaged once per epoch
+    train_losses = torch.empty(n_train_batches, device=device)
+    val_losses = torch.empty(n_val_batches, device=device)
 
-            # put data on device
-            X_train, y_train = X_train.to(device), y_train.to(device)
+    # predictions of the last epoch (stay empty if there are no epochs or batches)
+    if return_predictions:
+        train_pred, train_true = np.empty((0, num_classes), dtype=np.float32), np.empty(0, dtype=np.int64)
+        val_pred, val_true = np.empty((0, num_classes), dtype=np.float32), np.empty(0, dtype=np.int64)
 
-            # calculate the forward pass
-            y_pred_train = model(X_train)
+    # create a training and test loop
+    for epoch in tqdm(range(EPOCHS), disable=not is_main_process):
 
-            # calculate the training loss and add (accumulate) the loss to the counter
-            training_loss = loss_function(y_pred_train, y_train)
-            batch_train_loss += training_loss
-            batch_train_acc += torchmetrics.functional.accuracy(preds=y_pred_train.argmax(dim=1), target=y_train,
-                                                                task="multiclass", num_classes=y_pred_train.shape[1])
+        # the predictions are only collected on the last epoch
+        collect_predictions = return_predictions and epoch == EPOCHS - 1
 
-            # optimizer zero grad
-            optimizer.zero_grad()
+        # reshuffle the distributed shards every epoch
+        if isinstance(train_dataloader.sampler, DistributedSampler):
+            train_dataloader.sampler.set_epoch(epoch)
 
-            # calcuate the loss backwards (backpropagation)
-            training_loss.backward()
+        # model to train mode
+        model.train()
 
-            # optimizer step
-            optimizer.step()
+        # optimizer zero grad
+        optimizer.zero_grad(set_to_none=True)
 
-        # divide total train loss by length of train dataloader: Average training loss per batch
-        batch_train_loss /= len(train_dataloader)
-        batch_train_acc /= len(train_dataloader)
+        # store the predictions in pre-allocated device tensors (copied to the cpu once after the loop),
+        # sized by the sampler so a distributed process only holds its own shard
+        if collect_predictions:
+            all_train_pred = torch.empty((n_train_samples, num_classes), device=device)
+            all_train_true = torch.empty(n_train_samples, dtype=torch.long, device=device)
+            train_idx = 0
 
-        # validation loss counter
-        batch_val_loss, batch_val_acc = 0, 0
+        # training: loop thorugh the training batches
+        for batch, (X_train, y_train) in enumerate(train_batches):
+
+            # put data on device (a no-op for batches already prefetched to the device)
+            X_train, y_train = X_train.to(device, non_blocking=True), y_train.to(device, non_blocking=True)
+
+            # images in channels_last to match the model
+            if X_train.dim() == 4:
+                X_train = X_train.contiguous(memory_format=torch.channels_last)
+
+            # optimizer step and zero grad every accumulation_steps batches (and on the last batch of the epoch)
+            optimizer_step = (batch + 1) % accumulation_steps == 0 or (batch + 1) == n_train_batches
+
+            # batches in the current accumulation group (the last group of the epoch may be smaller)
+            group_size = min(accumulation_steps, n_train_batches - batch // accumulation_steps * accumulation_steps)
+
+            # with DistributedDataParallel the gradients are only all-reduced on the optimizer step
+            # (no_sync has to cover the forward pass too, that is where DistributedDataParallel prepares the all-reduce)
+            if ddp_model is not None and not optimizer_step:
+                sync_context = ddp_model.no_sync()
+            else:
+                sync_context = contextlib.nullcontext()
+
+            with sync_context:
+
+                # calculate the forward pass and the training loss under autocast
+                with torch.autocast(device_type="cuda", dtype=amp_dtype, enabled=use_cuda):
+                    y_pred_train = model(X_train)
+                    training_loss = loss_function(y_pred_train, y_train)
+
+                # calcuate the loss backwards (backpropagation), outside autocast so the fp32 weights stay authoritative
+                # the loss is scaled by 1 / group_size so the accumulated gradient is the mean over the batches
+                # the scaler is a no-op unless training in float16
+                scaler.scale(training_loss / group_size).backward()
+
+            # infer the number of classes and build the accuracy metrics on the first batch
+            if train_acc_metric is None:
+                num_classes = y_pred_train.shape[1]
+                train_acc_metric = torchmetrics.Accuracy(task="multiclass", num_classes=num_classes).to(device)
+                val_acc_metric = torchmetrics.Accuracy(task="multiclass", num_classes=num_classes).to(device)
+
+            # store the loss, detached so the batch's graph is freed
+            train_losses[batch] = training_loss.detach()
+            train_acc_metric.update(y_pred_train.detach(), y_train)
+
+            # store the predictions
+            if collect_predictions:
+                b = X_train.size(0)
+                all_train_pred[train_idx:train_idx + b] = y_pred_train.detach()
+                all_train_true[train_idx:train_idx + b] = y_train
+                train_idx += b
+
+            if optimizer_step:
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad(set_to_none=True)
+
+        # average training loss per batch
+        batch_train_loss = train_losses.mean()
+        batch_train_acc = train_acc_metric.compute()
+        train_acc_metric.reset()
+
+        # copy the predictions to the cpu in one go
+        if collect_predictions:
+            train_pred = all_train_pred[:train_idx].cpu().numpy()
+            train_true = all_train_true[:train_idx].cpu().numpy()
 
         # model to validation mode
         model.eval()
 
+        # store the predictions in pre-allocated device tensors (copied to the cpu once after the loop)
+        if collect_predictions:
+            all_val_pred = torch.empty((n_val_samples, num_classes), device=device)
+            all_val_true = torch.empty(n_val_samples, dtype=torch.long, device=device)
+            val_idx = 0
+
         # inference mode diasables gradient tracking
         with torch.inference_mode():
 
             # validation: loop thorugh the validation batches
-            for batch, (X_val, y_val) in enumerate(val_dataloader):
-
-                # put data on device
-                X_val, y_val = X_val.to(device), y_val.to(device)
-
-                # calculate the forward pass
-                y_pred_val = model(X_val)
-
-                # calculate the validation loss and add (accumulate) the loss to the counter
-                val_loss = loss_function(y_pred_val, y_val)
-                batch_val_loss += val_loss
-                batch_val_acc += torchmetrics.functional.accuracy(preds=y_pred_val.argmax(dim=1), target=y_val,
-                                                                  task="multiclass", num_classes=y_pred_val.shape[1])
-
-            # divide total validation loss by length of val dataloader: Average validation loss per batch
-            batch_val_loss /= len(val_dataloader)
-            batch_val_acc /= len(val_dataloader)
+            for batch, (X_val, y_val) in enumerate(val_batches):
+
+                # put data on device (a no-op for batches already prefetched to the device)
+                X_val, y_val = X_val.to(device, non_blocking=True), y_val.to(device, non_blocking=True)
+
+                # images in channels_last to match the model
+                if X_val.dim() == 4:
+                    X_val = X_val.contiguous(memory_format=torch.channels_last)
+
+                # calculate the forward pass and the validation loss under autocast
+                with torch.autocast(device_type="cuda", dtype=amp_dtype, enabled=use_cuda):
+                    y_pred_val = model(X_val)
+                    val_loss = loss_function(y_pred_val, y_val)
+
+                # store the loss (no detach needed under inference mode)
+                val_losses[batch] = val_loss
+                val_acc_metric.update(y_pred_val, y_val)
+
+                # store the predictions
+                if collect_predictions:
+                    b = X_val.size(0)
+                    all_val_pred[val_idx:val_idx + b] = y_pred_val
+                    all_val_true[val_idx:val_idx + b] = y_val
+                    val_idx += b
+
+        # average validation loss per batch (outside inference mode, so the result can be all-reduced in place)
+        batch_val_loss = val_losses.mean()
+        batch_val_acc = val_acc_metric.compute()
+        val_acc_metric.reset()
+
+        # copy the predictions to the cpu in one go
+        if collect_predictions:
+            val_pred, val_true = all_val_pred[:val_idx].cpu().numpy(), all_val_true[:val_idx].cpu().numpy()
+
+        # average the losses over all processes (the accuracy metrics sync themselves in compute)
+        # (sum and divide, ReduceOp.AVG is only supported by the nccl backend)
+        if dist.is_initialized():
+            dist.all_reduce(batch_train_loss, op=dist.ReduceOp.SUM)
+            dist.all_reduce(batch_val_loss, op=dist.ReduceOp.SUM)
+            batch_train_loss /= dist.get_world_size()
+            batch_val_loss /= dist.get_world_size()
 
         # append the loss values to the lists
         results["Epoch"].append(epoch)
-        results["Train Loss"].append(batch_train_loss.detach().cpu().numpy())
-        results["Validation Loss"].append(batch_val_loss.detach().cpu().numpy())
-        results["Train Accuracy"].append(batch_train_acc.detach().cpu().numpy())
-        results["Validation Accuracy"].append(batch_val_acc.detach().cpu().numpy())
-
-        # Add loss results to SummaryWriter
-        writer.add_scalars(main_tag="Loss",
-                           tag_scalar_dict={"Train Loss": batch_train_loss,
-                                            "Validation Loss": batch_val_loss},
-                           global_step=epoch)
-
-        # Add accuracy results to SummaryWriter
-        writer.add_scalars(main_tag="Accuracy",
-                           tag_scalar_dict={"Train Accuracy": batch_train_acc,
-                                            "Validation Accuracy": batch_val_acc},
-                           global_step=epoch)
-
-        # Track the PyTorch model architecture, and pass in an example input
-        writer.add_graph(model=model,input_to_model=torch.randn(32, 3, 224, 224).to(device))
-
-        # print every epochs
-        if epoch % epoch_print == 0:
+        results["Train Loss"].append(batch_train_loss.item())
+        results["Validation Loss"].append(batch_val_loss.item())
+        results["Train Accuracy"].append(batch_train_acc.item())
+        results["Validation Accuracy"].append(batch_val_acc.item())
+
+        # Add loss and accuracy results (already converted to floats) to SummaryWriter, buffered until the next flush
+        if writer is not None:
+            for main_tag in ["Loss", "Accuracy"]:
+                writer.add_scalars(main_tag=main_tag,
+                                   tag_scalar_dict={f"Train {main_tag}": results[f"Train {main_tag}"][-1],
+                                                    f"Validation {main_tag}": results[f"Validation {main_tag}"][-1]},
+                                   global_step=epoch)
+
+        # print every epochs and flush the buffered Tensorboard events
+        if epoch % epoch_print == 0 and is_main_process:
+            if writer is not None:
+                writer.flush()
+
             # print
             print(f"Epoch: {epoch}\n-------")
             print(
                 f"Train Loss: {batch_train_loss:.5f} & Accuracy: {batch_train_acc:.5f} | Validation Loss:{batch_val_loss:.5f} & Accuracy: {batch_val_acc:.5f} \n")
 
     # Close the writer
-    writer.close()
+    if writer is not None:
+        writer.close()
 
     # convert the lists to pandas dataframe for plotting
     df_scores = pd.DataFrame(results)
 
     # print
-    print(f"Finished training.")
+    if is_main_process:
+        print(f"Finished training.")
+
+    # logits and true labels of the last epoch (use logits.argmax(axis=1) for the predicted labels)
+    if return_predictions:
+        return df_scores, {"logits": train_pred, "true": train_true}, {"logits": val_pred, "true": val_true}
 
     return df_scores
 
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def ddp_training(rank: int, world_size: int, EPOCHS: int, model: torch.nn.Module, train_dataset: Dataset,
+                 val_dataset: Dataset, batch_size: int, loss_function: torch.nn.Module,
+                 optimizer: torch.optim.Optimizer, epoch_print: int, experiment_name: str, model_name: str,
+                 scores_path: str, accumulation_steps: int = 1, num_classes: int = None, num_workers: int = 2,
+                 backend: str = "nccl", master_port: str = "12355"):
+    """
+
+    This function trains the model with DistributedDataParallel on one gpu per process. Start it with
+    torch.multiprocessing.spawn(ddp_training, args=(world_size, EPOCHS, ...), nprocs=world_size).
+    spawn discards return values, so the first process saves the scores to scores_path (read them back with
+    pd.read_csv), it is also the only process logging to Tensorboard and printing.
+    Note: if the validation set does not divide evenly by world_size, the DistributedSampler pads it by repeating
+    samples, so the reported validation loss and accuracy include a few duplicates.
+
+    :param rank: int: Index of the process (and gpu).
+    :param world_size: int: Number of processes (and gpus).
+    :param EPOCHS: int: Number of epochs to train the model.
+    :param model: object: Model to train.
+    :param train_dataset: torch.utils.data.Dataset: Training data.
+    :param val_dataset: torch.utils.data.Dataset: Validation data.
+    :param batch_size: int: Batch size per process.
+    :param loss_function: object: Loss function to use.
+    :param optimizer: object: Optimizer to use, created on model.parameters().
+    :param epoch_print: int: print each epoch_print epochs.
+    :param experiment_name: str: Name of experiment (see create_writer).
+    :param model_name: str: Name of model (see create_writer).
+    :param scores_path: str: Path of the csv file the scores of training are saved to.
+    :param accumulation_steps: int: Number of batches to accumulate gradients over before each optimizer step. Defaults to 1.
+    :param num_classes: int: Number of classes. Defaults to None (inferred by training).
+    :param num_workers: int: Number of dataloader workers per process. Defaults to 2.
+    :param backend: str: torch.distributed backend. Defaults to "nccl".
+    :param master_port: str: Port of the first process used to set up the process group. Defaults to "12355".
+    :return: None
+    """
+
+    # join the process group, one process per gpu
+    os.environ.setdefault("MASTER_ADDR", "localhost")
+    os.environ.setdefault("MASTER_PORT", master_port)
+    dist.init_process_group(backend, rank=rank, world_size=world_size)
+    torch.cuda.set_device(rank)
+    device = torch.device("cuda", rank)
+
+    # wrap the model (in channels_last, before DistributedDataParallel builds its gradient buckets),
+    # gradients are all-reduced during the backward pass
+    model = DDP(model.to(device, memory_format=torch.channels_last), device_ids=[rank])
+
+    # each process loads its own shard of the data
+    train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True)
+    val_sampler = DistributedSampler(val_dataset, num_replicas=world_size, rank=rank, shuffle=False)
+    train_dataloader = DataLoader(train_dataset, batch_size=batch_size, sampler=train_sampler, pin_memory=True,
+                                  num_workers=num_workers, persistent_workers=num_workers > 0, drop_last=True)
+    val_dataloader = DataLoader(val_dataset, batch_size=batch_size, sampler=val_sampler, pin_memory=True,
+                                num_workers=num_workers, persistent_workers=num_workers > 0)
+
+    # only the first process writes to Tensorboard
+    writer = create_writer(experiment_name=experiment_name, model_name=model_name) if rank == 0 else None
+
+    try:
+        df_scores = training(EPOCHS=EPOCHS, model=model, train_dataloader=train_dataloader,
+                             val_dataloader=val_dataloader, loss_function=loss_function, optimizer=optimizer,
+                             epoch_print=epoch_print, writer=writer, device=device,
+                             accumulation_steps=accumulation_steps, num_classes=num_classes)
+
+        # the losses are averaged over all processes, so the first process saves the scores for everyone
+        if rank == 0:
+            df_scores.to_csv(scores_path, index=False)
+    finally:
+        dist.destroy_process_group()
+
+    return None
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #